@@ -11,17 +11,24 @@ Functions:
     map2colin: Extract RBH from a synteny file.
 """
 
-def blast(blast_file: str, map_file: str) -> None:
+def blast(blast_file: str, map_file: str, processes: int = 1) -> None:
     """
     Map the Reciprocal Best Hit (RBH) from BLAST results.
 
     Args:
         blast_file: Path to the input BLAST file.
         map_file:   Path to the output TSV file containing RBH pairs.
+        processes:  Number of worker processes used to parse blast_file.
     """
-    blast_results = utils.parse_blast_file(blast_file=blast_file)
-    rbh_pairs = utils.extract_rbh_pairs(results=blast_results)
-    utils.write_map_file(map_file=map_file, rbh_pairs=rbh_pairs)
+    prefixes, prefix_of_id, suffixes, best_partner = utils.stream_rbh(
+        blast_file=blast_file, processes=int(processes)
+    )
+    rbh_pairs, ordered_prefixes = utils.extract_rbh_pairs(
+        best_partner=best_partner, prefixes=prefixes, prefix_of_id=prefix_of_id
+    )
+    utils.write_map_file(
+        map_file=map_file, rbh_pairs=rbh_pairs, ordered_prefixes=ordered_prefixes, suffixes=suffixes
+    )
 
 def map2split(map_file: str, seq_file: str, output_basename: str) -> None:
     """
@@ -36,8 +43,7 @@ def map2split(map_file: str, seq_file: str, output_basename: str) -> None:
             Path to the output TSV files without extension.
     """
     sequence_set = utils.parse_seq_file(seq_file=seq_file)
-    fg, bg = utils.split_pairs(map_file=map_file, seqs=sequence_set)
-    utils.write_map2split_files(output_basename=output_basename, foreground_list=fg, background_list=bg)
+    utils.split_pairs(map_file=map_file, seqs=sequence_set, output_basename=output_basename)
 
 def map2colin(map_file: str, colin_file: str, output_file: str) -> None:
     """
@@ -1,137 +1,229 @@
 #!/usr/bin/env python3
 
+import mmap
+import os
 import sys
-from collections import defaultdict
+from array import array
 
 """
 Function Library for functions.
 
 Functions:
-    parse_blast_file: Parse blast_file to generate a list of parsed rows.
-    extract_rbh_pairs: Extract reciprocal best hits (RBH) from BLAST results.
-    load_prefix: Load and sort unique prefixes from the RBH pairs.
+    stream_rbh: Stream blast_file and keep only the best hit of each query.
+    extract_rbh_pairs: Extract reciprocal best hits (RBH) from the best hit of each query.
     write_map_file: Write the reciprocal best hit (RBH) pairs to map_file.
     parse_seq_file: Parse seq_file to generate a set of Sequence IDs.
-    split_pairs: Parse map_file and split mapping RBH pairs.
-    write_map2split_files: Write two foreground and background RBH pairs to output_file.
+    split_pairs: Parse map_file and write its RBH pairs to foreground and background files.
 """
 
-def parse_blast_file(blast_file: str) -> list:
+_MIN_CHUNK_SIZE = 1 << 24
+_NO_SCORE = float("-inf")
+_MAP_HEADER = b"# Reciprocal Best Hits\n"
+
+def stream_rbh(blast_file: str, processes: int = 1) -> tuple:
     """
-    Parse blast_file to generate a list of parsed rows.
+    Stream blast_file and keep only the best hit of each query.
+
+    With processes > 1, chunks of a regular blast_file are parsed in parallel,
+    one worker process per chunk, and their best hits are merged in file order.
+    Pipes and other non-seekable inputs are always parsed sequentially.
 
     Args:
         blast_file: Path to the input BLAST result file.
+        processes:  Maximum number of worker processes.
+
+    Returns:
+        Tuple of (prefixes, prefix_of_id, suffixes, best_partner): the sorted
+        unique prefixes, and the prefix ID (index into prefixes), suffix and
+        best subject ID (-1 if none) of each integer ID. Prefixes and
+        suffixes are bytes.
+    """
+    if processes > 1 and os.path.isfile(blast_file):
+        chunks = _chunk_ranges(blast_file=blast_file, n_chunks=processes)
+    else:
+        chunks = [(0, None)]
+    if len(chunks) == 1:
+        results = [_stream_chunk(blast_file, *chunks[0])]
+    else:
+        # Imported here so that small inputs and the map2split/map2colin commands
+        # do not pay for loading multiprocessing at startup.
+        import multiprocessing
+        with multiprocessing.Pool(len(chunks)) as pool:
+            results = pool.starmap(_stream_chunk, [(blast_file, start, end) for start, end in chunks])
+
+    seq_ids = {}
+    prefix_ids = {}
+    prefix_of_id = array("i")
+    suffixes = []
+    best_partner = array("i")
+    best_score = array("d")
+    for names, chunk_partner, chunk_score in results:
+        global_ids = array("i")
+        for seqid in names:
+            code = seq_ids.get(seqid)
+            if code is None:
+                code = _add_seq_id(seqid, seq_ids, prefix_ids, prefix_of_id, best_partner, best_score, suffixes)
+            global_ids.append(code)
+        for qid, sid in enumerate(chunk_partner):
+            if sid < 0:
+                continue
+            code = global_ids[qid]
+            if chunk_score[qid] > best_score[code]:
+                best_score[code] = chunk_score[qid]
+                best_partner[code] = global_ids[sid]
+
+    prefixes = sorted(prefix_ids)
+    prefix_rank = {prefix_ids[prefix]: rank for rank, prefix in enumerate(prefixes)}
+    prefix_of_id = array("i", [prefix_rank[prefix_id] for prefix_id in prefix_of_id])
+    return prefixes, prefix_of_id, suffixes, best_partner
+
+def _chunk_ranges(blast_file: str, n_chunks: int) -> list:
+    """
+    Split blast_file into at most n_chunks byte ranges aligned to line starts.
+
+    Files smaller than _MIN_CHUNK_SIZE per chunk are split into fewer chunks.
+
+    Returns:
+        List of (start, end) byte offsets.
+    """
+    size = os.path.getsize(blast_file)
+    n_chunks = max(1, min(n_chunks, size // _MIN_CHUNK_SIZE))
+    if n_chunks == 1:
+        return [(0, size)]
+
+    offsets = [0]
+    with open(blast_file, "rb") as blast_handle:
+        with mmap.mmap(blast_handle.fileno(), 0, access=mmap.ACCESS_READ) as blast_data:
+            for i in range(1, n_chunks):
+                offset = blast_data.find(b"\n", max(size * i // n_chunks, offsets[-1])) + 1
+                if offset == 0:
+                    break
+                offsets.append(offset)
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets, offsets[1:]) if start < end]
+
+def _stream_chunk(blast_file: str, start: int = 0, end: int = None) -> tuple:
+    """
+    Parse the rows of blast_file starting in [start, end) and keep the best hit of each query.
+
+    With end=None the whole file is read from its current position without seeking,
+    so that pipes can be parsed too.
 
     Returns:
-        List of tuples containing parsed BLAST results.
+        Tuple of (names, best_partner, best_score): the Sequence ID (bytes),
+        best subject ID (-1 if none) and its bitscore of each chunk-local integer ID.
     """
-    results = []
-    with open(blast_file, mode="r") as blast_handle:
+    seq_ids = {}
+    prefix_ids = {}
+    prefix_of_id = array("i")
+    best_partner = array("i")
+    best_score = array("d")
+    with open(blast_file, mode="rb", buffering=1 << 20) as blast_handle:
+        if end is not None:
+            blast_handle.seek(start)
+        position = start
         for line in blast_handle:
-            if line.startswith("#"):
+            if end is not None:
+                if position >= end:
+                    break
+                position += len(line)
+            if line.startswith(b"#"):
                 continue
-            li = line.strip().split("\t")
+            li = line.strip().split(b"\t")
             if len(li) != 12:
-                sys.stderr.write(f"Warning: Skipping malformed row (expected 12 columns, found {len(li)}): {line}\n")
+                sys.stderr.write(f"Warning: Skipping malformed row (expected 12 columns, found {len(li)}): "
+                                 f"{line.decode(errors='replace')}\n")
                 continue
             try:
-                qseqid, sseqid, _, _, _, _, _, _, _, _, _, bitscore = li
-                bitscore = float(bitscore)
+                bitscore = float(li[11])
             except ValueError:
-                sys.stderr.write(f"Error: Invalid numeric value in row: {line}\n")
+                sys.stderr.write(f"Error: Invalid numeric value in row: {line.decode(errors='replace')}\n")
                 continue
-            results.append((qseqid, sseqid, bitscore))
-    return results
 
-def extract_rbh_pairs(results: list) -> set:
-    """
-    Extract reciprocal best hits (RBH) from BLAST results.
+            qseqid = li[0]
+            sseqid = li[1]
+            qid = seq_ids.get(qseqid)
+            if qid is None:
+                qid = _add_seq_id(qseqid, seq_ids, prefix_ids, prefix_of_id, best_partner, best_score)
+            sid = seq_ids.get(sseqid)
+            if sid is None:
+                sid = _add_seq_id(sseqid, seq_ids, prefix_ids, prefix_of_id, best_partner, best_score)
+            if prefix_of_id[qid] == prefix_of_id[sid]:
+                continue
+            if bitscore > best_score[qid]:
+                best_score[qid] = bitscore
+                best_partner[qid] = sid
+    return list(seq_ids), best_partner, best_score
 
-    Args:
-        results: List of tuples containing parsed BLAST results.
+def _add_seq_id(seqid: bytes, seq_ids: dict, prefix_ids: dict, prefix_of_id: array,
+                best_partner: array, best_score: array, suffixes: list = None) -> int:
+    """
+    Assign the next integer ID to a new Sequence ID with no best hit yet,
+    and record its prefix ID and, if suffixes is given, its suffix.
 
     Returns:
-        Set containing RBH pairs.
+        The integer ID of seqid.
     """
-    best_hits = {}
-    for qseqid, sseqid, bitscore in results:
-        q_prefix, s_prefix = qseqid.split("_", 1)[0], sseqid.split("_", 1)[0]
-        if q_prefix == s_prefix:
-            continue
-        if qseqid not in best_hits or bitscore > best_hits[qseqid][1]:
-            best_hits[qseqid] = (sseqid, bitscore)
-
-    reciprocal_best_hits = defaultdict(list)
-    for qseqid, (sseqid, _) in best_hits.items():
-        if sseqid in best_hits and best_hits[sseqid][0] == qseqid:
-            reciprocal_best_hits[qseqid].append(sseqid)
-
-    rbh_pairs = set()
-    for qseqid, sseqids in reciprocal_best_hits.items():
-        for sseqid in sseqids:
-            rbh_pairs.add(tuple(sorted([qseqid, sseqid])))
-    return rbh_pairs
-
-
-def load_prefix(rbh_pairs: set) -> list:
+    code = seq_ids[seqid] = len(seq_ids)
+    prefix, _, suffix = seqid.partition(b"_")
+    prefix_of_id.append(prefix_ids.setdefault(prefix, len(prefix_ids)))
+    best_partner.append(-1)
+    best_score.append(_NO_SCORE)
+    if suffixes is not None:
+        suffixes.append(suffix)
+    return code
+
+def extract_rbh_pairs(best_partner: array, prefixes: list, prefix_of_id: array) -> tuple:
     """
-    Load and sort unique prefixes from the RBH pairs.
+    Extract reciprocal best hits (RBH) from the best hit of each query.
 
     Args:
-        rbh_pairs: Set of RBH pairs.
+        best_partner: Best subject ID (-1 if none) of each integer ID.
+        prefixes:     Sorted prefix of each prefix ID.
+        prefix_of_id: Prefix ID of each integer ID.
 
     Returns:
-        A sorted list of unique prefixes.
-    """
-    prefixes = []
-    for rbh1, rbh2 in rbh_pairs:
-        rbh1_prefix = rbh1.split("_")[0]
-        rbh2_prefix = rbh2.split("_")[0]
-        prefixes.append(rbh1_prefix)
-        prefixes.append(rbh2_prefix)
-
-    unique_prefixes = set(prefixes)
-    sorted_prefixes = sorted(unique_prefixes)
-    if len(sorted_prefixes) != 2:
-        sys.stderr.write("Warning: Expected exactly 2 unique prefixes.\n")
-        return
-    return sorted_prefixes
-
-
-def write_map_file(map_file: str, rbh_pairs: set) -> None:
+        Tuple of (rbh_pairs, sorted_prefixes): the set of RBH pairs of integer
+        IDs ordered by prefix, and the sorted unique prefixes found in them.
+    """
+    rbh_pairs = set()
+    pair_prefix_ids = set()
+    for qid, sid in enumerate(best_partner):
+        if sid < 0 or prefix_of_id[qid] > prefix_of_id[sid]:
+            continue
+        if best_partner[sid] == qid:
+            rbh_pairs.add((qid, sid))
+            pair_prefix_ids.add(prefix_of_id[qid])
+            pair_prefix_ids.add(prefix_of_id[sid])
+    sorted_prefixes = [prefixes[prefix_id] for prefix_id in sorted(pair_prefix_ids)]
+    return rbh_pairs, sorted_prefixes
+
+def write_map_file(map_file: str, rbh_pairs: set, ordered_prefixes: list, suffixes: list) -> None:
     """
     Write the reciprocal best hit (RBH) pairs to map_file.
 
     Args:
-        map_file: Path to the output file.
-        rbh_pairs: Set of RBH pairs.
+        map_file:         Path to the output file.
+        rbh_pairs:        Set of RBH pairs of integer IDs, ordered by prefix.
+        ordered_prefixes: Sorted unique prefixes of the RBH pairs.
+        suffixes:         Suffix of each integer ID.
     """
     if not rbh_pairs:
         sys.stderr.write("Warning: No reciprocal best hits found.\n")
         return
 
-    ordered_prefixes = load_prefix(rbh_pairs)
     if len(ordered_prefixes) != 2:
         sys.stderr.write("Warning: Expected exactly 2 unique prefixes.\n")
         return
 
-    ordered_pairs = []
-    for rbh1, rbh2 in rbh_pairs:
-        rbh1_prefix, rbh1_suffix = rbh1.split("_", 1)
-        rbh2_prefix, rbh2_suffix = rbh2.split("_", 1)
-        if rbh1_prefix < rbh2_prefix:
-            ordered_pairs.append((rbh1_suffix, rbh2_suffix))
-        else:
-            ordered_pairs.append((rbh2_suffix, rbh1_suffix))
+    ordered_pairs = [b"%s\t%s\n" % (suffixes[rbh1], suffixes[rbh2]) for rbh1, rbh2 in rbh_pairs]
 
-    with open(map_file, mode="w") as map_handle:
-        map_handle.write("# Reciprocal Best Hits\n")
-        map_handle.write(f"#\t{"\t".join(ordered_prefixes)}\n")
-        for ordered_pair in ordered_pairs:
-            map_handle.write(f"{"\t".join(ordered_pair)}\n")
+    with open(map_file, mode="wb", buffering=1 << 20) as map_handle:
+        map_handle.write(_MAP_HEADER)
+        map_handle.write(b"#\t%s\t%s\n" % tuple(ordered_prefixes))
+        map_handle.write(b"".join(ordered_pairs))
 
-def parse_seq_file(seq_file: str) -> set:
+def parse_seq_file(seq_file: str) -> frozenset:
     """
     Parse seq_file to generate a set of Sequence IDs.
 
@@ -140,60 +232,42 @@ def parse_seq_file(seq_file: str) -> set:
             Path to the input text file.
 
     Returns:
-        set: A set of Sequence IDs parsed from seq_file.
+        frozenset: A set of Sequence IDs (bytes) parsed from seq_file.
     """
-    seqs = set()
-    with open(seq_file, "r") as seq_handle:
-        for line in seq_handle:
-            if line.startswith("#"):
-                continue
-            seq_name = line.strip()
-            seqs.add(seq_name)
-    return seqs
+    with open(seq_file, "rb") as seq_handle:
+        return frozenset(line.strip() for line in seq_handle if not line.startswith(b"#"))
 
-def split_pairs(map_file: str, seqs: set) -> list:
+def split_pairs(map_file: str, seqs: frozenset, output_basename: str) -> None:
     """
-    Parse map_file and split mapping RBH pairs.
+    Parse map_file and write its RBH pairs to foreground and background files.
 
     Args:
         map_file:
             Path to the input TSV file containing RBH pairs.
         seqs:
-            A set of Sequence IDs.
-
-    Returns:
-        Two list included foreground RBH pairs and background RBH pairs.
+            A set of Sequence IDs (bytes).
+        output_basename:
+            Path to the output TSV files without extension.
     """
-    foreground = []
-    background = []
-    with open(map_file, "r") as map_handle:
+    with open(map_file, "rb") as map_handle, \
+            open(f"{output_basename}_foreground.txt", "wb", buffering=1 << 20) as foreground_handle, \
+            open(f"{output_basename}_background.txt", "wb", buffering=1 << 20) as background_handle:
+        write_foreground = foreground_handle.write
+        write_background = background_handle.write
         for line in map_handle:
-            if line.startswith("#"):
+            if line.startswith(b"#"):
                 continue
             pairs = line.strip()
-            pair1, pair2 = pairs.split("\t")
+            try:
+                pair1, pair2 = pairs.split(b"\t")
+            except ValueError:
+                sys.stderr.write(f"Warning: Skipping malformed row (expected 2 columns): "
+                                 f"{line.decode(errors='replace')}\n")
+                continue
             if pair1 in seqs or pair2 in seqs:
-                foreground.append(pairs)
+                write_foreground(pairs + b"\n")
             else:
-                background.append(pairs)
-    return foreground, background
-
-def write_map2split_files(output_basename: str, foreground_list: list, background_list: list) -> None:
-    """
-    Write two foreground and background RBH pairs to output_file.
-
-    Args:
-        output_basename:
-            Path to the output TSV files without extension.
-        foreground_list:
-            A list of foreground RBH pairs.
-        background_list:
-            A list of background RBH pairs.
-    """
-    for group, items in zip(["foreground", "background"], [foreground_list, background_list]):
-        output_file = f"{output_basename}_{group}.txt"
-        with open(output_file, "w") as output_handle:
-            output_handle.write("\n".join(items) + "\n")
+                write_background(pairs + b"\n")
 
 def parse_map_file(map_file: str) -> list:
     pairs = []
@@ -220,7 +294,7 @@ def parse_colin_file(colin_file: str) -> dict:
                     continue
                 score, e_value, n_part, seq_part, plusminus = li
                 n_value = int(n_part.split("=")[1])
-                seq_names = seq_part.split("&")
+                seq_names = [sys.intern(seq_name) for seq_name in seq_part.split("&")]
                 if align_id not in results:
                     results[align_id] = (seq_names, n_value, [])
 
@@ -228,16 +302,15 @@ def parse_colin_file(colin_file: str) -> dict:
                 parts = line.split()
                 if len(parts) >= 3:
                     align_id = int(parts[0].split("-")[0])
-                    gene1, gene2 = parts[2:4]
                     if align_id in results:
-                        results[align_id][2].append((gene1, gene2))
+                        results[align_id][2].append((sys.intern(parts[2]), sys.intern(parts[3])))
     return results
 
 def write_map2colin_file(pairs: list, results: dict, output_file: str) -> None:
-    pairs_set = {frozenset(pair) for pair in pairs}
+    pairs_set = {(a, b) if a < b else (b, a) for a, b in pairs}
     with open(output_file, "w") as output_handle:
         for align_id, (seq_names, n_value, gene_pairs) in results.items():
-            rbh_pairs = [pair for pair in gene_pairs if frozenset(pair) in pairs_set]
+            rbh_pairs = [(a, b) for a, b in gene_pairs if ((a, b) if a < b else (b, a)) in pairs_set]
             output_handle.write(f"##\t{align_id}\t{seq_names[0]}\t{seq_names[1]}\t{n_value}\t{len(rbh_pairs)}\n")
             for gene1, gene2 in rbh_pairs:
                 output_handle.write(f"{align_id}\t{gene1}\t{gene2}\n")
\ No newline at end of file